@@ -1,14 +1,37 @@
 import os
+import concurrent.futures
+import errno
+import functools
 import subprocess
 import time
 import shutil
-import json
-import mdstat
+import mmap
 import socket
-import psutil
-import requests
 import datetime
-import yaml
+import types
+
+# orjson is considerably faster than the stdlib parser for both ignition.json
+# and the node configuration; fall back when it is not shipped in the initramfs.
+try:
+    import orjson as _json
+    _json_loads_buffer = _json.loads
+except ImportError:
+    import json as _json
+
+    def _json_loads_buffer(buf):
+        # The stdlib parser only takes str/bytes, so the mapping has to be copied
+        return _json.loads(bytes(buf))
+
+# Direct libc bindings for mount(2)/umount2(2), so mounting the root filesystem
+# does not need to fork+exec mount(8)/umount(8). ctypes needs libffi, which the
+# initramfs may not ship; fall back to the mount(8)/umount(8) binaries then.
+try:
+    import ctypes
+    _libc = ctypes.CDLL("libc.so.6", use_errno=True)
+    _libc.mount.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_ulong, ctypes.c_char_p]
+    _libc.umount2.argtypes = [ctypes.c_char_p, ctypes.c_int]
+except (ImportError, OSError, AttributeError):
+    _libc = None
 
 # --- Global Variables and Configuration ---
 # Extend the PATH for commonly used binaries within the initramfs environment.
@@ -21,56 +44,34 @@ IGNITION_FILE       = "/ignition.json"
 FS_INSTALLED_MARKER = ".filesystem_installed_marker"
 BOOTSTRAPPED_MARKER = ".bootstrapped_marker"
 SYSROOT             = "/sysroot"
+FS_INSTALLED_PATH   = SYSROOT + "/" + FS_INSTALLED_MARKER
+BOOTSTRAPPED_PATH   = SYSROOT + "/" + BOOTSTRAPPED_MARKER
+
+# Files personalized inside the target root
+SYSROOT_HOSTNAME    = SYSROOT + "/etc/hostname"
+SYSROOT_RESOLV      = SYSROOT + "/etc/resolv.conf"
+SYSROOT_SSH_DIR     = SYSROOT + "/root/.ssh"
+SYSROOT_AUTHKEYS    = SYSROOT_SSH_DIR + "/authorized_keys"
+SYSROOT_NETPLAN_DIR = SYSROOT + "/etc/netplan"
+SYSROOT_IFUPDOWN_DIR = SYSROOT + "/etc/network/interfaces.d"
+
+# Kernel, initrd and kexec script staged in the initramfs before kexec
+KERNEL_DST          = "/tmp/vmlinuz"
+INITRD_DST          = "/tmp/initrd.img"
+KEXEC_SCRIPT        = "/tmp/kexec.sh"
+
+# Set GOSH_DEBUG in the environment to get verbose diagnostics on the console.
+GOSH_DEBUG = bool(os.environ.get("GOSH_DEBUG"))
 
 # Declare IgnitionConfig as a global variable to be accessed across functions
 IgnitionConfig = None
 
+# storage.filesystems entries of IgnitionConfig keyed by mount path
+_FS_BY_PATH = {}
+
 # Node config
 NodeConfig = None
 
-class AttrDict:
-    """
-    A class that allows dictionary keys to be accessed as object attributes.
-    Handles nested dictionaries by converting them recursively.
-    """
-    def __init__(self, dictionary):
-        for key, value in dictionary.items():
-            if isinstance(value, dict):
-                setattr(self, key, AttrDict(value))
-            elif isinstance(value, list):
-                # Handle lists of dictionaries
-                setattr(self, key, [AttrDict(item) if isinstance(item, dict) else item for item in value])
-            else:
-                setattr(self, key, value)
-    def __str__(self):
-        """
-        Returns a string representation of the AttrDict instance,
-        mimicking a dictionary's string representation.
-        """
-        # Convert the AttrDict back to a regular dictionary for string representation
-        return str(self.__to_dict())
-
-    def __repr__(self):
-        """
-        Returns a more detailed string representation, useful for debugging.
-        """
-        return f"AttrDict({self.__to_dict()})"
-
-    def __to_dict(self):
-        """
-        Helper method to recursively convert AttrDict and its nested AttrDicts
-        back into standard dictionaries.
-        """
-        result = {}
-        for key, value in self.__dict__.items():
-            if isinstance(value, AttrDict):
-                result[key] = value.__to_dict()
-            elif isinstance(value, list):
-                result[key] = [item.__to_dict() if isinstance(item, AttrDict) else item for item in value]
-            else:
-                result[key] = value
-        return result
-
 # --- Helper for Marker Files ---
 def _create_marker_file(marker_name, sysroot_mounted=True):
     """
@@ -94,36 +95,168 @@ def _create_marker_file(marker_name, sysroot_mounted=True):
     except IOError as e:
         print(f"Warning: Could not create marker file {marker_path}: {e}", file=os.sys.stderr)
 
+# --- Helpers for Mounts ---
+def _mount(source, target, fstype, flags=0, data=None):
+    """
+    Mounts source on target with mount(2), or mount(8) when libc can't be
+    bound (flags are only honoured by mount(2)). Raises OSError on failure.
+    """
+    if _libc is None:
+        options = ["-o", data] if data else []
+        try:
+            run_command(["mount", "-t", fstype, *options, source, target])
+        except subprocess.CalledProcessError as e:
+            raise OSError(errno.EIO, f"mount {source} on {target}: exit status {e.returncode}") from e
+        return
+    ret = _libc.mount(source.encode(), target.encode(), fstype.encode(), flags,
+                      data.encode() if data else None)
+    if ret != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, f"mount {source} on {target}: {os.strerror(err)}")
+
+def _umount(target, flags=0):
+    """
+    Unmounts target with umount2(2), or umount(8) when libc can't be bound
+    (flags are only honoured by umount2(2)). Raises OSError on failure.
+    """
+    if _libc is None:
+        try:
+            run_command(["umount", target])
+        except subprocess.CalledProcessError as e:
+            raise OSError(errno.EIO, f"umount {target}: exit status {e.returncode}") from e
+        return
+    if _libc.umount2(target.encode(), flags) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, f"umount {target}: {os.strerror(err)}")
+
+# --- Helper for File Writes ---
+def _write_file(path, content, mode=0o644, dir_fd=None, fchmod=False):
+    """
+    Writes content to path with a single write(2) on a raw descriptor,
+    bypassing the buffered text layer of open().
+
+    Args:
+        path (str): File to create or truncate.
+        content (str): Full file contents.
+        mode (int): Permission bits used if the file is created.
+        dir_fd (int): If given, path is resolved relative to this directory descriptor.
+        fchmod (bool): If True, also apply mode to a file that already existed.
+    """
+    data = content.encode()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode, dir_fd=dir_fd)
+    try:
+        if fchmod:
+            os.fchmod(fd, mode)
+        written = os.write(fd, data)
+        # Regular files take the whole buffer at once; loop only for short writes
+        while written < len(data):
+            written += os.write(fd, data[written:])
+    finally:
+        os.close(fd)
+
+# --- Helper for File Copies ---
+def _fast_copy(src, dst, mode=0o644):
+    """
+    Copies src to dst inside the kernel with copy_file_range(2), falling back
+    to sendfile(2) where the filesystems involved don't support it.
+
+    Args:
+        src (str): Path of the file to copy.
+        dst (str): Destination path, created or truncated.
+        mode (int): Permission bits used if dst is created.
+    """
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        # Start readahead of the whole source while the destination is set up
+        os.posix_fadvise(src_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(src_fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        try:
+            remaining = os.fstat(src_fd).st_size
+            use_copy_file_range = True
+            while remaining > 0:
+                copied = 0
+                if use_copy_file_range:
+                    try:
+                        copied = os.copy_file_range(src_fd, dst_fd, remaining)
+                    except OSError as e:
+                        if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                            raise
+                    if copied == 0:
+                        # Cross-filesystem or unsupported: continue with sendfile
+                        use_copy_file_range = False
+                        continue
+                else:
+                    copied = os.sendfile(dst_fd, src_fd, None, remaining)
+                    if copied == 0:
+                        break # Source shrank underneath us
+                remaining -= copied
+        finally:
+            os.close(dst_fd)
+        # The source is read exactly once; don't let it crowd out other cached pages
+        os.posix_fadvise(src_fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(src_fd)
+
+# --- Helper for Fatal Errors ---
+def _emergency_shell(msg):
+    """
+    Reports msg and replaces this process with an interactive shell. Pending
+    writes are synced first so the operator sees a consistent filesystem.
+    Does not return.
+    """
+    print(msg, file=os.sys.stderr)
+    os.sys.stdout.flush()
+    os.sys.stderr.flush()
+    try:
+        os.sync()
+    except OSError:
+        pass
+    os.execv("/bin/bash", ["bash"])
+
 # --- Functions ---
 
-def run_command(command, check_success=True, shell=True, capture_output=False, stderr_to_stdout=True):
+@functools.lru_cache(maxsize=None)
+def _resolve_binary(name):
+    """
+    Looks a program up on PATH once. Returns its absolute path, or None if it
+    can't be found (the exec then fails and reports it as usual).
+    """
+    return shutil.which(name)
+
+def run_command(argv, check_success=True, capture_output=False):
     """
-    Runs a shell command and optionally checks its success.
+    Runs a command directly (no intermediate /bin/sh) and optionally checks its success.
 
     Args:
-        command (str or list): The command to execute.
+        argv (list): The program and its arguments.
         check_success (bool): If True, raises an exception if the command fails.
-        shell (bool): If True, the command will be executed through the shell.
-        capture_output (bool): If True, captures stdout and stderr.
-        stderr_to_stdout (bool): If True and capture_output is True, redirects stderr to stdout.
+        capture_output (bool): If True, captures stdout with stderr merged into it.
 
     Returns:
         subprocess.CompletedProcess: The result of the command execution.
     """
+    output = subprocess.PIPE if capture_output else None
+    errors = subprocess.STDOUT if capture_output else None
     try:
-        if capture_output:
-            result = subprocess.run(command, shell=shell, check=check_success,
-                                    capture_output=True, text=True)
-        else:
-            result = subprocess.run(command, shell=shell, check=check_success)
-        return result
+        # Pre-resolved executable skips the PATH walk on exec; argv[0] stays as given
+        return subprocess.run(argv, executable=_resolve_binary(argv[0]),
+                              check=check_success, stdout=output, stderr=errors,
+                              text=capture_output)
     except subprocess.CalledProcessError as e:
         print(f"Error: Command failed: {e.cmd}", file=os.sys.stderr)
         if capture_output:
-            print(f"Output: {e.stdout}", file=os.sys.stderr) # stdout contains stderr if stderr_to_stdout
+            print(f"Output: {e.stdout}", file=os.sys.stderr)
         if check_success:
             raise
         return None
+    except OSError as e:
+        # Without a shell a missing binary surfaces as OSError rather than exit
+        # status 127; report it the same way so callers keep a single except clause.
+        print(f"Error: Command failed: {argv}: {e}", file=os.sys.stderr)
+        if check_success:
+            raise subprocess.CalledProcessError(127, argv) from e
+        return None
 
 def setup_initial_filesystems():
     """
@@ -132,8 +265,8 @@ def setup_initial_filesystems():
     """
     print("Mounting /proc and /sys...")
     try:
-        run_command("mount -t proc none /proc")
-        run_command("mount -t sysfs none /sys")
+        run_command(["mount", "-t", "proc", "none", "/proc"])
+        run_command(["mount", "-t", "sysfs", "none", "/sys"])
         return True
     except Exception as e:
         print(f"Error: Failed to mount initial filesystems: {e}", file=os.sys.stderr)
@@ -151,12 +284,12 @@ def load_kernel_modules():
         "mlx5_core", "mlx5_en", "mlx5_ib", "mlx5_eswitch",
         "nvme", "nvme_core", "nvme_pci"
     ]
-    for module in modules:
-        try:
-            run_command(f"modprobe {module}", check_success=False)
-        except Exception:
-            print(f"Warning: {module} module not found or failed to load.", file=os.sys.stderr)
-    run_command("lsmod")
+    # modprobe -a loads every module in one process and carries on past failures
+    result = run_command(["modprobe", "-a", *modules], check_success=False)
+    if result is None or result.returncode != 0:
+        print("Warning: some modules were not found or failed to load.", file=os.sys.stderr)
+    if GOSH_DEBUG:
+        run_command(["lsmod"])
     return True
 
 def create_dev_nodes():
@@ -167,24 +300,30 @@ def create_dev_nodes():
     """
     print("Creating /dev entries with mdev...")
     try:
-        run_command("mount -t devtmpfs devtmpfs /dev")
+        run_command(["mount", "-t", "devtmpfs", "devtmpfs", "/dev"])
     except Exception as exc:
         print(f"failed to mount /dev/ {exc}")
-    run_command("/bin/mdev -s")
+    run_command(["/bin/mdev", "-s"])
 
 def read_ignition_file(ignition_dest_path=IGNITION_FILE):
     """
     Reads ignition.json and loads as json
     """
-    global IgnitionConfig
+    global IgnitionConfig, _FS_BY_PATH
     try:
-        with open(ignition_dest_path, 'r') as f:
-            IgnitionConfig = AttrDict(json.load(f))
+        with open(ignition_dest_path, 'rb') as f:
+            # Parse straight out of the page cache instead of copying into a buffer
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    IgnitionConfig = _json_loads_buffer(view)
+        filesystems = IgnitionConfig.get("storage", {}).get("filesystems", [])
+        _FS_BY_PATH = {fs.get("path"): fs for fs in filesystems}
+        if GOSH_DEBUG:
             print(IgnitionConfig)
     except FileNotFoundError:
         print(f"Error: {ignition_dest_path} not found after Ignition run.", file=os.sys.stderr)
         return False
-    except json.JSONDecodeError as e:
+    except (ValueError, _json.JSONDecodeError) as e:
         print(f"Error: Failed to parse JSON from {ignition_dest_path}: {e}", file=os.sys.stderr)
         return False
     return True
@@ -227,7 +366,7 @@ def write_kexec_command(kernel_path, initramfs_path, kernel_cmdline):
     Returns:
         bool: True on success, False on error.
     """
-    target_file = os.path.join("/sysroot", BOOTSTRAPPED_MARKER)
+    target_file = BOOTSTRAPPED_PATH
     print(f"Attempting to write kexec command to {target_file}...")
 
     if not all([kernel_path, initramfs_path, kernel_cmdline]):
@@ -243,7 +382,7 @@ def write_kexec_command(kernel_path, initramfs_path, kernel_cmdline):
         print(f"Error: Initramfs image not found at {initramfs_path}.", file=os.sys.stderr)
         return False
 
-    if not os.path.isdir("/sysroot"):
+    if not os.path.isdir(SYSROOT):
         print("Error: The /sysroot directory does not exist or is not a directory.", file=os.sys.stderr)
         print("This function assumes a chroot or similar environment where /sysroot is the target root.", file=os.sys.stderr)
         return False
@@ -270,26 +409,28 @@ def get_ignition_root():
     Returns root fs entry from ignition config.
     """
     print(f"Reading root fs entry from ignition.json")
-    for fs in IgnitionConfig.storage.filesystems:
-        if fs.path == "/":
-            return fs
-    raise Exception("failed to find root filesystem")
+    try:
+        return _FS_BY_PATH["/"]
+    except KeyError:
+        raise Exception("failed to find root filesystem") from None
 
 def assemble_raid(fs):
-    print(f"Probing for raid in {fs.device}")
-    if "md" in fs.device: # Raided device
-        for raid in IgnitionConfig.storage.raid:
-            if fs.device.split("/")[-1] in raid.name:
-                devices = " ".join(raid.devices)
+    import mdstat
+
+    print(f"Probing for raid in {fs['device']}")
+    if "md" in fs["device"]: # Raided device
+        for raid in IgnitionConfig["storage"]["raid"]:
+            if fs["device"].split("/")[-1] in raid["name"]:
+                devices = list(raid["devices"])
                 try:
                     mdstat_detail = mdstat.parse()
                     for raid, raid_detail in mdstat_detail["devices"].items():
                         if raid_detail["active"]:
                             print(f"Stopping raid /dev/{raid}")
-                            run_command(f"mdadm --stop /dev/{raid}")
+                            run_command(["mdadm", "--stop", f"/dev/{raid}"])
 
-                    print(f"Assembling raid device {fs.device} with {devices}")
-                    run_command(f"mdadm --assemble {fs.device} {devices}")
+                    print(f"Assembling raid device {fs['device']} with {' '.join(devices)}")
+                    run_command(["mdadm", "--assemble", fs["device"], *devices])
                     return True
                 except subprocess.CalledProcessError as exc:
                     print(f"Failed to assemble raid, probably raid was not created.")
@@ -308,27 +449,23 @@ def get_filesystem_type(device_path):
     """
     try:
         # Run blkid command to get information about the device
-        # -o export: output in a key="value" format
+        # -o value: print the bare value, no key="value" parsing needed
         # -s TYPE: only show the TYPE attribute
         result = subprocess.run(
-            ['blkid', '-o', 'export', '-s', 'TYPE', device_path],
+            ['blkid', '-o', 'value', '-s', 'TYPE', device_path],
             capture_output=True,
             text=True,
-            check=True
+            check=False
         )
-        output = result.stdout.strip()
-        print(f"DEBUG: blkid {output}")
-        
-        for line in output.splitlines():
-            if line.startswith("TYPE="):
-                # Extract the filesystem type
-                fs_type = line.split('=')[1].strip('"')
-                print(f"Found {fs_type} at {device_path}")
-                return fs_type
-        return None # No FSTYPE found, likely no filesystem
-    except subprocess.CalledProcessError:
+        fs_type = result.stdout.strip()
+        if GOSH_DEBUG:
+            print(f"DEBUG: blkid {fs_type}")
+
         # blkid returns non-zero exit code if no filesystem or device not found
-        return None
+        if result.returncode != 0 or not fs_type:
+            return None # No FSTYPE found, likely no filesystem
+        print(f"Found {fs_type} at {device_path}")
+        return fs_type
     except FileNotFoundError:
         print(f"Error: 'blkid' command not found. Please ensure it's installed and in your PATH.")
         return None
@@ -341,23 +478,62 @@ def mount_root():
     assemble_raid(root_fs)
 
     # Device exists?
-    if not os.path.exists(root_fs.device):
+    if not os.path.exists(root_fs["device"]):
         return False
 
     # Filesystem created?
-    if not get_filesystem_type(root_fs.device):
+    if not get_filesystem_type(root_fs["device"]):
         return False
 
-    run_command(f"mount -t {root_fs.format} {root_fs.device} {SYSROOT}")
+    _mount(root_fs["device"], SYSROOT, root_fs["format"])
 
     return True
 
+def _dhclient_files(if_name):
+    """
+    Returns the per-interface pidfile and leasefile arguments for dhclient, so
+    parallel attempts don't share (and signal each other through) the defaults.
+    """
+    return ["-pf", f"/var/lib/dhcp/dhclient.{if_name}.pid",
+            "-lf", f"/var/lib/dhcp/dhclient.{if_name}.leases"]
+
+def _start_dhcp(if_name):
+    """
+    Starts dhclient on one interface in the background, limited to 10 seconds.
+
+    Returns:
+        subprocess.Popen: The running attempt, or None if it could not be started.
+    """
+    print(f"Attempting DHCP on {if_name} for up to 10 seconds...")
+    try:
+        # Using 'dhclient' (common in Buildroot) with a timeout.
+        return subprocess.Popen(["timeout", "10", "dhclient", "-v", *_dhclient_files(if_name), if_name])
+    except OSError as e:
+        print(f"DHCP failed on {if_name}: {e}", file=os.sys.stderr)
+        run_command(["ip", "link", "set", "dev", if_name, "down"], check_success=False)
+        return None
+
+def _stop_dhcp(if_name, proc):
+    """
+    Abandons a DHCP attempt: stops the dhclient still probing, releases the
+    lease of one that already daemonized, then drops any address and brings
+    the interface down.
+    """
+    if proc.poll() is None:
+        proc.terminate()
+        proc.wait()
+    # -r only acts on the client recorded in this interface's own pidfile
+    run_command(["dhclient", "-r", *_dhclient_files(if_name), if_name], check_success=False)
+    run_command(["ip", "addr", "flush", "dev", if_name], check_success=False)
+    run_command(["ip", "link", "set", "dev", if_name, "down"], check_success=False)
+
 def configure_network():
     """
     Attempts to bring up network interfaces and obtain an IP address via DHCP.
     """
     print("Probing for network interfaces and attempting DHCP...")
-    run_command("ls /sys/class/net/", check_success=False) # ls might fail if /sys/class/net is empty
+    if GOSH_DEBUG:
+        print(os.listdir("/sys/class/net/"))
 
     os.makedirs("/var/lib/dhcp/", exist_ok=True)
     # BusyBox dhclient might need /var/run, which is often a symlink to /run.
@@ -367,25 +543,47 @@ def configure_network():
     except FileExistsError:
         pass # Symlink already exists
 
-    for interface_entry in os.listdir("/sys/class/net/"):
-        if_name = os.path.basename(interface_entry)
-
-        if if_name == "lo" or not if_name:
-            continue
+    interfaces = []
+    with os.scandir("/sys/class/net/") as entries:
+        for interface_entry in entries:
+            if_name = interface_entry.name
+
+            if if_name == "lo" or not if_name:
+                continue
+
+            print(f"Found network interface: {if_name}")
+            print(f"Bringing interface {if_name} up...")
+            run_command(["ip", "link", "set", "dev", if_name, "up"])
+            interfaces.append(if_name)
+
+    # DHCP is network-bound, so try every interface at once and take the
+    # first lease instead of waiting out each timeout in turn.
+    attempts = {}
+    for if_name in interfaces:
+        proc = _start_dhcp(if_name)
+        if proc:
+            attempts[if_name] = proc
+
+    leased_if = None
+    while attempts and leased_if is None:
+        finished = [(if_name, proc) for if_name, proc in attempts.items() if proc.poll() is not None]
+        for if_name, proc in finished:
+            del attempts[if_name]
+            if proc.returncode == 0:
+                leased_if = if_name
+                break
+            print(f"DHCP failed on {if_name}. Bringing interface down.", file=os.sys.stderr)
+            run_command(["ip", "link", "set", "dev", if_name, "down"], check_success=False)
+        if not finished:
+            time.sleep(0.05)
 
-        print(f"Found network interface: {if_name}")
-        print(f"Bringing interface {if_name} up...")
-        run_command(f"ip link set dev {if_name} up")
+    # Only the winning interface may keep a lease, route and resolv.conf
+    for if_name, proc in attempts.items():
+        _stop_dhcp(if_name, proc)
 
-        print(f"Attempting DHCP on {if_name} for up to 10 seconds...")
-        try:
-            # Using 'dhclient' (common in Buildroot) with a timeout.
-            subprocess.run(f"timeout 10 dhclient -v {if_name}", shell=True, check=True)
-            print(f"Successfully obtained IP on {if_name} using dhclient!")
-            return True # Success
-        except subprocess.CalledProcessError:
-            print(f"DHCP failed on {if_name}. Bringing interface down.", file=os.sys.stderr)
-            run_command(f"ip link set dev {if_name} down", check_success=False)
+    if leased_if:
+        print(f"Successfully obtained IP on {leased_if} using dhclient!")
+        return True # Success
 
     print("Network probing complete. No network connection could be detected.")
     return False # Failure
@@ -396,7 +594,7 @@ def provision_storage():
     and mounts it to /sysroot. This prepares the system for chrooting
     into the main operating system.
     """
-    run_command("mkdir -p /run")
+    run_command(["mkdir", "-p", "/run"])
 
     ignition_source_path = "/ignition.json"
     ignition_dest_path = "/run/ignition.json"
@@ -405,14 +603,15 @@ def provision_storage():
         print(f"Error: {ignition_source_path} not found. Cannot determine root partition.", file=os.sys.stderr)
         return False
     try:
-        shutil.copy(ignition_source_path, ignition_dest_path)
+        # copyfile skips the mode/stat copy and uses the kernel's in-place copy on Linux
+        shutil.copyfile(ignition_source_path, ignition_dest_path)
     except IOError as e:
         print(f"Error: Failed to copy {ignition_source_path} to {ignition_dest_path}: {e}", file=os.sys.stderr)
         return False
 
     print("Running /usr/bin/ignition to configure disks...")
     try:
-        run_command("/usr/bin/ignition -platform file -stage disks")
+        run_command(["/usr/bin/ignition", "-platform", "file", "-stage", "disks"])
     except subprocess.CalledProcessError:
         print("Error: Ignition disk stage failed.", file=os.sys.stderr)
         return False
@@ -426,7 +625,7 @@ def final_setup():
     """
     print("Performing final setup steps...")
     try:
-        run_command("mount -t tmpfs tmpfs /run -o mode=0755,nodev,nosuid", check_success=False)
+        run_command(["mount", "-t", "tmpfs", "tmpfs", "/run", "-o", "mode=0755,nodev,nosuid"], check_success=False)
     except Exception:
         print("WARNING: Failed to mount /run as tmpfs.", file=os.sys.stderr)
 
@@ -435,20 +634,22 @@ def final_setup():
     return True
 
 def transfer_rootfs(source="rsync://10.10.6.5/images/k8s-worker-dgx-h200-image-060525/*",
-                    destination="/sysroot", max_retries=5, delay=10):
+                    destination=SYSROOT, max_retries=5, delay=10):
     """
     Transfers the root filesystem from a remote source using rsync.
     Note: This function is commented out by default in main.
           Uncomment it in main to enable rootfs transfer.
     """
-    rsync_options = "-azP --info=progress2,name0 --no-inc-recursive"
+    # The source is passed verbatim so rsync, not a local shell, expands the
+    # trailing wildcard on the remote side.
+    rsync_argv = ["rsync", "-azP", "--info=progress2,name0", "--no-inc-recursive", source, destination]
 
     retry_count = 0
     while True:
         print(f"Attempt {retry_count + 1} of {max_retries}...")
         try:
-            # Use subprocess.run for rsync, as it might be a long-running process
-            subprocess.run(f"rsync {rsync_options} {source} {destination}", shell=True, check=True)
+            # Output is not captured, so rsync progress goes straight to the console
+            subprocess.run(rsync_argv, check=True)
             print("rsync completed successfully.")
             break
         except subprocess.CalledProcessError as e:
@@ -471,11 +672,21 @@ def get_raid_uuid(device):
     Read raid uuid using madadm command
     """
     try:
-        output = run_command(f"mdadm --detail {device} | grep -i uuid", capture_output=True)
-        uuid = "-".join(output.stdout.split(":")[1:]).strip()
-        return uuid
-    except subprocess.CalledProcessError as e:
-        print(f"failed to get raid uuid")
+        # --export prints KEY=value lines, no shell pipeline needed to pick MD_UUID
+        result = subprocess.run(
+            ["mdadm", "--detail", "--export", device],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"failed to get raid uuid: {e}")
+        return None
+
+    for line in result.stdout.splitlines():
+        if line.startswith("MD_UUID="):
+            return line[len("MD_UUID="):].strip()
+    print(f"failed to get raid uuid: no MD_UUID for {device}")
     return None
 
 def generate_bootstrapped_file():
@@ -489,7 +700,7 @@ def generate_bootstrapped_file():
     root_uuid = ""
     # Extract UUID from the global `IgnitionConfig`
     root_fs = get_ignition_root()
-    root_uuid = root_fs.uuid
+    root_uuid = root_fs.get("uuid")
     
     if root_uuid:
         print(f"Identified root UUID: {root_uuid}")
@@ -498,10 +709,10 @@ def generate_bootstrapped_file():
 
     kexec_cmdline = NodeConfig["kernel_arguments"]
     
-    if "md" in root_fs.device:
-        raid_uuid = get_raid_uuid(root_fs.device)
+    if "md" in root_fs["device"]:
+        raid_uuid = get_raid_uuid(root_fs["device"])
         if not raid_uuid:
-            raise Exception(f"failed to read raid uuid for {root_fs.device}")
+            raise Exception(f"failed to read raid uuid for {root_fs['device']}")
         kexec_cmdline = f"{kexec_cmdline} rd.md=1 rd.md.auto=1 rd.md.uuid={raid_uuid} "
     
     if root_uuid:
@@ -509,15 +720,8 @@ def generate_bootstrapped_file():
 
     else:
         # Fallback to device path if UUID is not available.
-        # This requires re-extracting the device path from `IgnitionConfig` or storing it.
-        # Given `IgnitionConfig` is global, we can try to find it.
-        root_disk_fallback = None
-        if 'storage' in IgnitionConfig and 'filesystems' in IgnitionConfig['storage']:
-            for fs in IgnitionConfig['storage']['filesystems']:
-                if fs.get('path') == '/':
-                    root_disk_fallback = fs.get('device')
-                    break
-        
+        root_disk_fallback = root_fs.get('device')
+
         if root_disk_fallback:
             print(f"Warning: Using device path ({root_disk_fallback}) for root, consider providing UUID for robustness.", file=os.sys.stderr)
             kexec_cmdline = f"{kexec_cmdline} root={root_disk_fallback}"
@@ -525,7 +729,7 @@ def generate_bootstrapped_file():
             print("Critical: Neither UUID nor device path found for root. Kexec command line for root will be incomplete.", file=os.sys.stderr)
             return False # Cannot generate a reliable kexec command without root info
 
-    if not write_kexec_command("/tmp/vmlinuz", "/tmp/initrd.img", kexec_cmdline):
+    if not write_kexec_command(KERNEL_DST, INITRD_DST, kexec_cmdline):
         print("Error: Failed to write kexec command.", file=os.sys.stderr)
         return False
     return True
@@ -554,16 +758,36 @@ def get_mac_address_for_ip(target_ip):
     Returns:
         str: The MAC address (e.g., '00:11:22:33:44:55') or None if not found.
     """
+    import psutil
+
+    # net_if_addrs() walks every NIC, so query it once and reuse the per-interface list
     for interface_name, snics in psutil.net_if_addrs().items():
+        # Check for IPv4 address and if it matches the target_ip
+        if not any(snic.family == socket.AF_INET and snic.address == target_ip for snic in snics):
+            continue
+        # Once the IP is matched, look for the MAC address (AF_LINK)
         for snic in snics:
-            # Check for IPv4 address and if it matches the target_ip
-            if snic.family == socket.AF_INET and snic.address == target_ip:
-                # Once the IP is matched, look for the MAC address (AF_LINK)
-                for mac_snic in psutil.net_if_addrs().get(interface_name, []):
-                    if mac_snic.family == psutil.AF_LINK: # AF_LINK is for MAC address
-                        return mac_snic.address.replace('-', ':').lower() # Format to common MAC style
+            if snic.family == psutil.AF_LINK: # AF_LINK is for MAC address
+                return snic.address.replace('-', ':').lower() # Format to common MAC style
+        return None
     return None
 
+@functools.lru_cache(maxsize=1)
+def _http_session():
+    """
+    Returns the shared HTTP session for the nodeconfigserver: it keeps the
+    connection alive and retries transient failures with exponential backoff.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(max_retries=Retry(
+        total=5, backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504], allowed_methods=["GET"])))
+    return session
+
 def read_node_configuration():
     """
     Reads node configuration from nodeconfigserver specified on kernel command line
@@ -572,97 +796,88 @@ def read_node_configuration():
     node_config_server = kernel_args["nodeconfigserver"]
     node_config_server_port = kernel_args["nodeconfigserverport"]
     mac = get_mac_address_for_ip(get_my_ip())
-    for retry in range(0, 5):
-        response = requests.get(f"http://{node_config_server}:{node_config_server_port}/nodes/{mac}.json")
-        response.raise_for_status()
-        if 'application/json' in response.headers.get('Content-Type', ''):
-            return response.json()
+    # Retries and backoff are handled by the session's HTTPAdapter
+    url = f"http://{node_config_server}:{node_config_server_port}/nodes/{mac}.json"
+    response = _http_session().get(url, timeout=(2, 5))
+    response.raise_for_status()
+    if 'application/json' in response.headers.get('Content-Type', ''):
+        # Parse the raw body with the same fast parser used for ignition.json
+        return _json.loads(response.content)
+    print(f"Unexpected Content-Type from nodeconfigserver: {response.headers.get('Content-Type')}",
+          file=os.sys.stderr)
     return None
 
+@functools.lru_cache(maxsize=1)
 def read_proc_cmdline():
     """
     Returns map of all arguments in cmdline that has "="
+
+    The kernel command line cannot change while we run, so the result is
+    parsed once and cached; it is returned read-only since it is shared.
     """
     config = {}
-    with open("/proc/cmdline") as inf:
-        tokens = inf.read().split()
+    # /proc/cmdline is a single short line; a bare read avoids the buffered
+    # file object setup (fstat, ioctl, lseek) done by open().
+    fd = os.open("/proc/cmdline", os.O_RDONLY)
+    try:
+        data = os.read(fd, 4096)
+    finally:
+        os.close(fd)
+    tokens = data.decode().split()
+    if GOSH_DEBUG:
         print(tokens)
-        for token in tokens:
-            if "=" in token:
-                ents = token.split("=")
-                config[ents[0]] = ents[1]
-    print(config)
-    return config
-
-import os
-import datetime
-
-def compare_file_mtime_with_unix_timestamp(file_path, unix_timestamp_str):
+    for token in tokens:
+        # partition keeps any further '=' in the value (e.g. "rd.md.uuid=a=b")
+        key, sep, value = token.partition("=")
+        if sep:
+            config[key] = value
+    if GOSH_DEBUG:
+        print(config)
+    return types.MappingProxyType(config)
+
+def _stat_mtime(path):
     """
-    Compares a file's modified timestamp with a given Unix timestamp string.
-
-    Args:
-        file_path (str): The path to the file.
-        unix_timestamp_str (str): A string representing a Unix timestamp.
-
-    Returns:
-        str: A string indicating the comparison result, or an error message.
+    Returns the modification time of path, or None if it does not exist.
+    A single stat answers both "does it exist" and "how old is it".
     """
     try:
-        # 1. Get the file's modified timestamp
-        file_mtime_unix = os.path.getmtime(file_path)
-        print(f"File '{file_path}' modified Unix timestamp: {file_mtime_unix}")
-        print(f"File '{file_path}' modified datetime: {datetime.datetime.fromtimestamp(file_mtime_unix)}")
-
-
-        # 2. Convert the given Unix timestamp string to an integer
-        given_unix_timestamp = int(unix_timestamp_str)
-        print(f"Given Unix timestamp string: {unix_timestamp_str}")
-        print(f"Given Unix timestamp (int): {given_unix_timestamp}")
-        print(f"Given datetime: {datetime.datetime.fromtimestamp(given_unix_timestamp)}")
-
-        # 3. Compare the two values
-        if file_mtime_unix > given_unix_timestamp:
-            return 1
-        elif file_mtime_unix < given_unix_timestamp:
-            return -1
-        else:
-            return 0
+        return os.stat(path).st_mtime
     except FileNotFoundError:
-        return -2
-    except ValueError:
-        return -2
-    except Exception as e:
-        return -2
-    
+        return None
+
+def _yaml_quote(value):
+    """
+    Returns value as a double-quoted YAML scalar, so strings like IPs or MACs
+    are never re-typed as numbers by the YAML parser.
+    """
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
 def generate_netplan_yaml(interfaces):
     """
     Generates a Netplan YAML configuration from a given JSON input.
 
+    The schema is fixed and small, so the document is assembled directly from
+    string fragments rather than built as a dict and run through a YAML dumper.
+
     Args:
         interfaces (dict): A dictionary containing interface configurations.
 
     Returns:
         str: A string representing the Netplan YAML configuration.
     """
-
-    netplan_config = {
-        "network": {
-            "version": 2,
-            "renderer": "networkd",
-            "ethernets": {}
-        }
-    }
+    lines = [
+        "network:",
+        "    version: 2",
+        "    renderer: networkd",
+    ]
+    if not interfaces:
+        lines.append("    ethernets: {}")
+        return "\n".join(lines) + "\n"
+    lines.append("    ethernets:")
 
     for interface_name, interface_config in interfaces.items():
-        ethernet_config = {
-            "dhcp4": False,  # Assuming static configuration for provided data
-            "addresses": [],
-            "routes": []
-        }
-        mac_address = interface_config.get("mac")
-        if mac_address:
-            ethernet_config["macaddress"] = mac_address
+        addresses = []
+        routes = []
 
         # IP address and netmask
         ipv4_address = interface_config.get("ipv4")
@@ -672,39 +887,47 @@ def generate_netplan_yaml(interfaces):
             from ipaddress import IPv4Interface
             try:
                 ip_interface = IPv4Interface((ipv4_address, netmask))
-                ethernet_config["addresses"].append(str(ip_interface))
+                addresses.append(str(ip_interface))
             except Exception as e:
                 print(f"Warning: Could not parse IP address or netmask for {interface_name}: {e}")
 
         # Gateway
         gateway = interface_config.get("gateway")
         if gateway:
-            ethernet_config["routes"].append({"to": "0.0.0.0/0", "via": gateway})
+            routes.append(("0.0.0.0/0", gateway))
 
         # Routes
-        routes = interface_config.get("routes", [])
-        for route in routes:
+        for route in interface_config.get("routes", []):
             to = route.get("ip_or_range")
             is_default = route.get("default", False)
 
-            if to:
-                if is_default:
-                    # Default route is already handled by 'gateway'
-                    continue
-                else:
-                    route_entry = {"to": to}
-                    ethernet_config["routes"].append(route_entry)
+            # Default route is already handled by 'gateway'
+            if to and not is_default:
+                routes.append((to, None))
 
-        netplan_config["network"]["ethernets"][interface_name] = ethernet_config
+        lines.append(f"        {_yaml_quote(interface_name)}:")
+        lines.append("            dhcp4: false")  # Assuming static configuration for provided data
+        if addresses:
+            lines.append("            addresses:")
+            lines.extend(f"            - {_yaml_quote(address)}" for address in addresses)
+        else:
+            lines.append("            addresses: []")
+        if routes:
+            lines.append("            routes:")
+            for to, via in routes:
+                lines.append(f"            -   to: {_yaml_quote(to)}")
+                if via:
+                    lines.append(f"                via: {_yaml_quote(via)}")
+        else:
+            lines.append("            routes: []")
 
-    # Use a custom representer to prevent aliases for repeated data (e.g., gateway)
-    class NoAliasDumper(yaml.Dumper):
-        def ignore_aliases(self, data):
-            return True
+        mac_address = interface_config.get("mac")
+        if mac_address:
+            lines.append(f"            macaddress: {_yaml_quote(mac_address)}")
 
-    return yaml.dump(netplan_config, Dumper=NoAliasDumper, sort_keys=False, indent=4)
+    return "\n".join(lines) + "\n"
 
-def remove_netplan_files(netplan_dir="/sysroot/etc/netplan/"):
+def remove_netplan_files(netplan_dir=SYSROOT_NETPLAN_DIR):
     """
     Removes all .yaml files from the specified Netplan directory.
 
@@ -726,6 +949,51 @@ def remove_netplan_files(netplan_dir="/sysroot/etc/netplan/"):
             except OSError as e:
                 print(f"Error removing {file_path}: {e}")
 
+def install_netplan_config(content, netplan_dir=SYSROOT_NETPLAN_DIR, filename="01-netcfg.yaml"):
+    """
+    Replaces every Netplan YAML file in netplan_dir with a single configuration file.
+
+    Stale files are unlinked and the new file is written under a temporary name
+    and renamed into place, all relative to one directory descriptor: the
+    directory path is resolved once and the new config appears atomically.
+
+    Args:
+        content (str): The Netplan YAML configuration.
+        netplan_dir (str): The directory where Netplan YAML files are located.
+        filename (str): Name of the configuration file to install.
+    """
+    tmp_name = f".{filename}.tmp"
+    try:
+        os.makedirs(netplan_dir, exist_ok=True)
+        dir_fd = os.open(netplan_dir, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError as e:
+        print(f"Error opening Netplan directory {netplan_dir}: {e}. Please ensure you have permissions.")
+        return
+
+    try:
+        for name in os.listdir(dir_fd):
+            # The target itself is replaced by the rename below
+            if name.endswith(".yaml") and name != filename:
+                try:
+                    os.unlink(name, dir_fd=dir_fd)
+                    print(f"Successfully removed: {os.path.join(netplan_dir, name)}")
+                except OSError as e:
+                    print(f"Error removing {os.path.join(netplan_dir, name)}: {e}")
+
+        file_path = os.path.join(netplan_dir, filename)
+        try:
+            _write_file(tmp_name, content, dir_fd=dir_fd)
+            os.rename(tmp_name, filename, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+            print(f"Netplan configuration saved to: {file_path}")
+        except OSError as e:
+            print(f"Error writing Netplan file {file_path}: {e}. Please check permissions.")
+            try:
+                os.unlink(tmp_name, dir_fd=dir_fd)
+            except OSError:
+                pass
+    finally:
+        os.close(dir_fd)
+
 def generate_ifupdown_interfaces(interfaces):
     """
     Generates ifupdown configuration content for files under /etc/network/interfaces.d/
@@ -770,6 +1038,9 @@ def generate_ifupdown_interfaces(interfaces):
             config_lines.append(f"    gateway {gateway}")
 
         # Static Routes
+        # The fixed parts of each route line only depend on the interface
+        route_prefix = "    post-up ip route add "
+        route_suffix = f" dev {interface_name}"
         routes = interface_config.get("routes", [])
         for route in routes:
             to = route.get("ip_or_range")
@@ -781,7 +1052,7 @@ def generate_ifupdown_interfaces(interfaces):
                     # Ensure route destination is valid
                     try:
                         # Validate the route destination (e.g., "192.168.0.0/24")
-                        config_lines.append(f"    post-up ip route add {to} dev {interface_name}")
+                        config_lines.append(route_prefix + str(to) + route_suffix)
                     except Exception as e:
                         print(f"Warning (ifupdown): Could not parse route destination '{to}' for {interface_name}: {e}")
 
@@ -795,32 +1066,21 @@ def save_config_files(config_type, configs, output_dir):
     Saves generated configuration content to files in the specified directory.
 
     Args:
-        config_type (str): "netplan" or "ifupdown".
-        configs (str or dict): The configuration content (string for netplan, dict for ifupdown).
+        config_type (str): "ifupdown".
+        configs (dict): The configuration content for each interface.
         output_dir (str): The directory where files should be saved.
     """
-    if not os.path.exists(output_dir):
-        try:
-            os.makedirs(output_dir)
-            print(f"Created directory: {output_dir}")
-        except OSError as e:
-            print(f"Error creating directory {output_dir}: {e}. Please ensure you have permissions.")
-            return
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+    except OSError as e:
+        print(f"Error creating directory {output_dir}: {e}. Please ensure you have permissions.")
+        return
 
-    if config_type == "netplan":
-        file_path = os.path.join(output_dir, "01-netcfg.yaml")
-        try:
-            with open(file_path, "w") as f:
-                f.write(configs)
-            print(f"Netplan configuration saved to: {file_path}")
-        except IOError as e:
-            print(f"Error writing Netplan file {file_path}: {e}. Please check permissions.")
-    elif config_type == "ifupdown":
+    if config_type == "ifupdown":
         for interface_name, content in configs.items():
             file_path = os.path.join(output_dir, f"{interface_name}.cfg")
             try:
-                with open(file_path, "w") as f:
-                    f.write(content)
+                _write_file(file_path, content)
                 print(f"ifupdown configuration for {interface_name} saved to: {file_path}")
             except IOError as e:
                 print(f"Error writing ifupdown file {file_path}: {e}. Please check permissions.")
@@ -832,40 +1092,45 @@ def process_systemd_service():
     Fix systemd service in target
     """
     try:
-        chroot_script = """
-#!/bin/bash
-mount --bind /dev  /sysroot/dev
-mount --bind /proc /sysroot/proc
-mount --bind /sys  /sysroot/sys
-"""
-        for service in NodeConfig["systemd"]["enable"]:
-            chroot_script += f"chroot /bin/bash -c 'systemctl enable {service}' \n"
-
-        for service in NodeConfig["systemd"]["enable"]:
-            chroot_script += f"chroot /bin/bash -c 'systemctl disable {service}' \n"
-        
-        chroot_script += """
-umount /sysroot/sys
-umount /sysroot/proc
-umount /sysroot/dev
-"""
+        # The shebang must be the first line now that the script is exec'd directly
+        parts = [
+            "#!/bin/bash",
+            "mount --bind /dev  /sysroot/dev",
+            "mount --bind /proc /sysroot/proc",
+            "mount --bind /sys  /sysroot/sys",
+        ]
+        # systemctl takes several units at once, so a single chroot covers every
+        # service instead of one chroot + shell + systemctl per unit. A batch is
+        # all-or-nothing, so on failure retry unit by unit to keep one stale
+        # name from blocking the rest.
+        systemctl_cmds = []
+        for action in ("enable", "disable"):
+            units = " ".join(NodeConfig["systemd"].get(action, []))
+            if units:
+                systemctl_cmds.append(f"systemctl {action} {units} || "
+                                      f"for unit in {units}; do systemctl {action} $unit; done")
+        if systemctl_cmds:
+            parts.append(f"chroot /sysroot /bin/bash -c '{'; '.join(systemctl_cmds)}'")
+        parts.extend([
+            "umount /sysroot/sys",
+            "umount /sysroot/proc",
+            "umount /sysroot/dev",
+        ])
+        chroot_script = "\n".join(parts) + "\n"
+
         with open("/tmp/systemd_services.sh", "w") as outf:
             outf.write(chroot_script)
 
         os.chmod("/tmp/systemd_services.sh", 0o755)
-        run_command("/tmp/systemd_services.sh")
+        run_command(["/tmp/systemd_services.sh"])
     except subprocess.CalledProcessError as exc:
-        print(f"failed to setup systemd service in target {exc}")
-        os.execv("/bin/bash", ["bash"])
+        _emergency_shell(f"failed to setup systemd service in target {exc}")
 
 # --- Main Script Execution Flow ---
 def main():
     print("--- Starting Initramfs Script ---")
 
-    try:
-        os.makedirs("/sysroot")
-    except Exception as exc:
-        print(f"WARNING: failed to create /sysroot")
+    os.makedirs(SYSROOT, exist_ok=True)
 
     # Early Initramfs Setup (markers go to initramfs /tmp, not persistent across reboots)
     # This phase ensures basic environment is ready.
@@ -873,125 +1138,148 @@ def main():
     if not setup_initial_filesystems():
         print("Critical Error: Initial filesystem setup failed. Dropping to emergency shell.", file=os.sys.stderr)
 
+    # mdev -s is a one-shot scan of /sys, so the storage and NIC drivers must
+    # have probed before it runs.
     load_kernel_modules()
     create_dev_nodes()
     configure_network()
 
+    # The node configuration comes over HTTP and the ignition file from local
+    # disk; neither needs the other, so fetch them concurrently.
     global NodeConfig
-    NodeConfig = read_node_configuration()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        node_config_read = executor.submit(read_node_configuration)
+        ignition_read = executor.submit(read_ignition_file)
+        NodeConfig = node_config_read.result()
+        ignition_ok = ignition_read.result()
+
     if not NodeConfig:
-        print("Failed to read node configuration from nodeconfigserver")
-        os.execv("/bin/bash", ["bash"])
+        _emergency_shell("Failed to read node configuration from nodeconfigserver")
 
-    if not read_ignition_file():
+    if not ignition_ok:
         print("Critical Error: failed to read ignition file", file=os.sys.stderr)
         return
 
+    # Parsed once here; both marker mtime checks below compare against it
+    try:
+        config_timestamp = int(NodeConfig["config_timestamp"])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        print("failed to parse config timestamp")
+        config_timestamp = None
+    else:
+        # Diagnostic only; a date out of the platform's range must not discard the value
+        try:
+            print(f"Config timestamp: {config_timestamp} ({datetime.datetime.fromtimestamp(config_timestamp)})")
+        except (OverflowError, OSError, ValueError):
+            print(f"Config timestamp: {config_timestamp}")
+
     root_fs = get_ignition_root()
     assemble_raid(root_fs)
 
     # Device exists?
-    print(f"Checking if {root_fs.device} exists")
-    if not os.path.exists(root_fs.device):
+    print(f"Checking if {root_fs['device']} exists")
+    if not os.path.exists(root_fs["device"]):
         if not provision_storage():
-            os.execv("/bin/bash", ["bash"])
+            _emergency_shell(f"Failed to provision storage for {root_fs['device']}")
 
     # Filesystem created?
-    print(f"Checking if FS exists on {root_fs.device}")
-    if not get_filesystem_type(root_fs.device):
+    print(f"Checking if FS exists on {root_fs['device']}")
+    if not get_filesystem_type(root_fs["device"]):
         if not provision_storage():
-            os.execv("/bin/bash", ["bash"])
+            _emergency_shell(f"Failed to create filesystem on {root_fs['device']}")
 
-    print(f"Mounting {root_fs.device} at {SYSROOT} as {root_fs.format}")
-    run_command(f"mount -t {root_fs.format} {root_fs.device} {SYSROOT}")
+    print(f"Mounting {root_fs['device']} at {SYSROOT} as {root_fs['format']}")
+    _mount(root_fs["device"], SYSROOT, root_fs["format"])
 
     # If rootfs was not copied properly
-    if not os.path.exists(os.path.join("/sysroot/", FS_INSTALLED_MARKER)):
+    rootfs_just_transferred = False
+    fs_installed_mtime = _stat_mtime(FS_INSTALLED_PATH)
+    if fs_installed_mtime is None:
         if not transfer_rootfs():
-            os.execv("/bin/bash", ["bash"])
-    
-    if NodeConfig["provisioning_status"] == "sync":
-        transfer_rootfs()
-    
-    if not os.path.exists(os.path.join("/sysroot/", BOOTSTRAPPED_MARKER)):
-        # Create boostrapped file
-        generate_bootstrapped_file()
-    
-    compare_ret = compare_file_mtime_with_unix_timestamp(
-        os.path.join("/sysroot/", BOOTSTRAPPED_MARKER), 
-        NodeConfig["config_timestamp"])
-    if compare_ret == -2:
-        print("failed to compare config timestamp")
+            _emergency_shell("Failed to transfer rootfs")
+        rootfs_just_transferred = True
+
+    # Sync mode re-transfers the rootfs, unless that just happened above or the
+    # last completed transfer is already newer than the node configuration.
+    if NodeConfig["provisioning_status"] == "sync" and not rootfs_just_transferred:
+        if config_timestamp is not None and fs_installed_mtime > config_timestamp:
+            print("rootfs was transferred after config_timestamp, skipping sync")
+        else:
+            transfer_rootfs()
     
-    if compare_ret == -1:
-        print("config_timestamp is more recent, regenerating bootstrapped file")
+    bootstrapped_mtime = _stat_mtime(BOOTSTRAPPED_PATH)
+    if bootstrapped_mtime is None:
+        # Create boostrapped file; it is fresh, so there is nothing to compare
         generate_bootstrapped_file()
+    else:
+        if config_timestamp is None:
+            print("failed to compare config timestamp")
+        elif bootstrapped_mtime < config_timestamp:
+            print("config_timestamp is more recent, regenerating bootstrapped file")
+            generate_bootstrapped_file()
 
     try:
-        filename = os.path.join("/sysroot", "etc/hostname")
+        filename = SYSROOT_HOSTNAME
         print(f"Updating {filename}")
-        with open(filename, "w") as outf:
-            outf.write(NodeConfig["name"])
+        _write_file(filename, NodeConfig["name"])
 
-        filename = os.path.join("/sysroot", "etc/resolv.conf")
+        filename = SYSROOT_RESOLV
         print(f"Updating {filename}")
-        with open(filename, "w") as outf:
-            for ds in NodeConfig["dns_servers"]:
-                outf.write(f"nameserver {ds}\n")
+        _write_file(filename, "".join(f"nameserver {ds}\n" for ds in NodeConfig["dns_servers"]))
 
-        os.makedirs("/sysroot/root/.ssh/", exist_ok=True)
-        filename = os.path.join("/sysroot", "root/.ssh/authorized_keys")
+        os.makedirs(SYSROOT_SSH_DIR, mode=0o700, exist_ok=True)
+        # makedirs leaves an existing directory's mode alone
+        os.chmod(SYSROOT_SSH_DIR, 0o700)
+        filename = SYSROOT_AUTHKEYS
         print(f"Updating {filename}")
-        with open(filename, "w") as outf:
-            ssh_key = NodeConfig["ssh_key"]
-            outf.write(f"nameserver {ssh_key}\n")
-
-        os.chmod(filename, 0o600)
+        # fchmod also tightens a file that already exists, e.g. from the rsync'd image
+        _write_file(filename, f"{NodeConfig['ssh_key']}\n", mode=0o600, fchmod=True)
     except Exception as exc:
-        print(f"Failed to personalize the image {exc}")
-        os.execv("/bin/bash", ["bash"])
+        _emergency_shell(f"Failed to personalize the image {exc}")
 
     try:
-        remove_netplan_files()
-
         # Generate netplan
         if NodeConfig["os_type"] == "dgx":
+            remove_netplan_files()
             ifdata = generate_ifupdown_interfaces(NodeConfig["interfaces"])
-            save_config_files("ifupdown", ifdata, "/sysroot/etc/network/interfaces.d")
+            save_config_files("ifupdown", ifdata, SYSROOT_IFUPDOWN_DIR)
             print(f"Wrote ifupdown {ifdata}")
         else:
+            # Removes the old YAML files and installs the new one in a single pass
             netplan_data = generate_netplan_yaml(NodeConfig["interfaces"])
-            save_config_files("netplan", netplan_data, "/sysroot/etc/netplan")        
+            install_netplan_config(netplan_data)
             print(f"Wrote netplan {netplan_data}")
     except Exception as exc:
-        print(f"Failed to generate netplan")
-        os.execv("/bin/bash", ["bash"])
+        _emergency_shell(f"Failed to generate network configuration {exc}")
 
     print("Copying kernel and initrd to tmp...")
-    shutil.copyfile(os.path.join("/sysroot", NodeConfig["kernel"]), "/tmp/vmlinuz")
-    shutil.copyfile(os.path.join("/sysroot", NodeConfig["initrd"]), "/tmp/initrd.img")
-    shutil.copyfile(os.path.join("/sysroot", BOOTSTRAPPED_MARKER), "/tmp/kexec.sh")
-    os.chmod("/tmp/kexec.sh", 0o700)
+    # Node config may give these as absolute paths (e.g. /sysroot/boot/...);
+    # os.path.join keeps those as-is, which plain concatenation would not.
+    _fast_copy(os.path.join(SYSROOT, NodeConfig["kernel"]), KERNEL_DST)
+    _fast_copy(os.path.join(SYSROOT, NodeConfig["initrd"]), INITRD_DST)
+    _fast_copy(BOOTSTRAPPED_PATH, KEXEC_SCRIPT)
+    os.chmod(KEXEC_SCRIPT, 0o700)
     
     process_systemd_service()
 
-    # Flush the changes
+    # Flush the changes: unmounting writes back everything dirty on /sysroot,
+    # so it doubles as the only durability barrier we need.
     try:
-        run_command("sync")
-        run_command("umount /sysroot")
-    except subprocess.CalledProcessError as exc:
-        print(f"Failed to sync sysroot {exc}")
+        _umount(SYSROOT)
+    except OSError as exc:
+        print(f"Failed to unmount sysroot {exc}, syncing instead")
+        os.sync()
 
     #Final boot action
     print("\n--- Initramfs Script Complete. Handing over control. ---")
     try:
-        os.execv("/tmp/kexec.sh", ["/tmp/kexec.sh"])
+        os.execv(KEXEC_SCRIPT, [KEXEC_SCRIPT])
     except OSError as e:
-        print(f"Error executing /tmp/kexec.sh: {e}", file=os.sys.stderr)
+        print(f"Error executing {KEXEC_SCRIPT}: {e}", file=os.sys.stderr)
 
-    print("No kexec command was executed or it failed. Dropping to emergency shell.", file=os.sys.stderr)
-    os.execv("/bin/bash", ["bash"]) # Fallback to an emergency shell if all else fails
+    # Fallback to an emergency shell if all else fails
+    _emergency_shell("No kexec command was executed or it failed. Dropping to emergency shell.")
 
 if __name__ == "__main__":
     main()
-    os.execv("/bin/bash", ["bash"])
\ No newline at end of file
+    _emergency_shell("Initramfs script returned. Dropping to emergency shell.")
\ No newline at end of file